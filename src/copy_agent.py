@@ -2,7 +2,7 @@ import asyncio
 import os
 import time
 from decimal import Decimal
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import base58
 from solana.rpc.async_api import AsyncClient
@@ -33,6 +33,8 @@ class CopyTradeAgent:
 
         self.wallet_address: Optional[str] = None
         self.wallet_private_key: Optional[str] = None
+        # (private_key, derived wallet address) of the last decoded key
+        self._derived_wallet: Optional[Tuple[str, str]] = None
         self.risk_config = risk_config or RiskConfig(
             max_trade_size_usd=Decimal("1000"),
             min_trade_size_usd=Decimal("10"),
@@ -68,11 +70,17 @@ class CopyTradeAgent:
 
     def set_wallet_private_key(self, private_key: str):
         """Set wallet private key for trade execution"""
+        # 同じ鍵の再設定ではデコードと鍵導出を省略
+        if self._derived_wallet is not None and self._derived_wallet[0] == private_key:
+            self.wallet_private_key = private_key
+            self.wallet_address = self._derived_wallet[1]
+            return
         try:
             private_key_bytes = base58.b58decode(private_key)
             keypair = Keypair.from_seed(private_key_bytes[:32])
             self.wallet_private_key = private_key
             self.wallet_address = str(keypair.pubkey())
+            self._derived_wallet = (private_key, self.wallet_address)
         except Exception as e:
             raise ValueError(f"Invalid private key: {e}")
 
@@ -19,16 +19,20 @@ MAX_IDS_PER_REQUEST = 100
 logger = logger.bind(name="jupiter")
 
 
+class PriceFetchError(Exception):
+    """Raised when a Jupiter price request fails or is rate limited"""
+
+
 class JupiterClient:
-    def __init__(self, rpc_url: str = RPC_URL):
+    def __init__(self, rpc_url: str = RPC_URL, poll_interval_s: float = 0.5):
         self.rpc_url = rpc_url
+        self.poll_interval_s = poll_interval_s
         self.ws_url = self.rpc_url.replace("http", "ws")
         self.session = None
         self.ws_session = None
         self.price_url = "https://api.jup.ag/price/v2"
         self.quote_url = "https://api.jup.ag/swap/v1"
         self.headers = {"User-Agent": "Mozilla/5.0", "Accept": "application/json"}
-        self.ws = None
 
     async def initialize(self):
         """Initialize Jupiter client"""
@@ -40,28 +44,27 @@ class JupiterClient:
             self.session = aiohttp.ClientSession(headers=self.headers)
         return self.session
 
-    async def ensure_ws(self):
-        """Ensure WebSocket connection is initialized"""
-        if self.ws is None:
-            if self.ws_session is None:
-                self.ws_session = aiohttp.ClientSession()
-            self.ws = await self.ws_session.ws_connect(self.ws_url)
-        return self.ws
+    async def ensure_ws_session(self):
+        """Ensure aiohttp session for WebSocket connections is initialized"""
+        if self.ws_session is None:
+            self.ws_session = aiohttp.ClientSession()
+        return self.ws_session
 
     async def close_ws(self):
-        """Close WebSocket connection"""
-        if self.ws:
-            await self.ws.close()
-            self.ws = None
+        """Close the WebSocket session"""
         if self.ws_session:
             await self.ws_session.close()
             self.ws_session = None
 
-    async def get_token_prices(self, mints: List[str]) -> Dict[str, Decimal]:
+    async def get_token_prices(
+        self, mints: List[str], raise_on_error: bool = False
+    ) -> Dict[str, Decimal]:
         """Get token prices from Jupiter API in batches
 
         Args:
             mints: List of token mint addresses
+            raise_on_error: Raise PriceFetchError when a batch fails or is rate
+                limited instead of skipping it (and waiting out the rate limit)
 
         Note:
             Jupiter API has a limit of 100 token IDs per request.
@@ -80,6 +83,8 @@ class JupiterClient:
 
                 async with session.get(url) as response:
                     if response.status == 429:  # Rate limit
+                        if raise_on_error:
+                            raise PriceFetchError("Rate limited by Jupiter API")
                         logger.warning(
                             "Rate limited by Jupiter API, waiting 10 seconds"
                         )
@@ -87,9 +92,10 @@ class JupiterClient:
                         continue
 
                     if response.status != 200:
-                        logger.error(
-                            f"Error from Jupiter API: {response.status} - {await response.text()}"
-                        )
+                        error = f"Error from Jupiter API: {response.status} - {await response.text()}"
+                        if raise_on_error:
+                            raise PriceFetchError(error)
+                        logger.error(error)
                         continue
 
                     data = await response.json()
@@ -100,7 +106,13 @@ class JupiterClient:
                             else:
                                 logger.debug(f"No price data for {mint}")
 
+            except PriceFetchError:
+                raise
             except Exception as e:
+                if raise_on_error:
+                    raise PriceFetchError(
+                        f"Error fetching prices for batch: {e}"
+                    ) from e
                 logger.error(f"Error fetching prices for batch: {e}")
                 continue
 
@@ -350,6 +362,10 @@ class JupiterClient:
     async def wait_for_transaction(self, signature: str, timeout: int = 60) -> bool:
         """Wait for transaction to be confirmed using WebSocket
 
+        Confirmation is pushed over a ``signatureSubscribe`` WebSocket. If the
+        WebSocket cannot be used, falls back to polling ``getSignatureStatuses``
+        every ``poll_interval_s`` seconds until the timeout.
+
         Args:
             signature: Transaction signature
             timeout: Timeout in seconds (default: 60)
@@ -357,64 +373,92 @@ class JupiterClient:
         Returns:
             True if transaction was confirmed, False otherwise
         """
+        deadline = time.monotonic() + timeout
         try:
-            ws = await self.ensure_ws()
-
-            # Subscribe to transaction confirmation
-            subscribe_msg = {
-                "jsonrpc": "2.0",
-                "id": 1,
-                "method": "signatureSubscribe",
-                "params": [
-                    signature,
-                    {
-                        "commitment": "confirmed",
-                        "enableReceivedNotification": True,
-                    },
-                ],
-            }
-            await ws.send_str(json.dumps(subscribe_msg))
-
-            # Wait for confirmation
-            start_time = time.time()
-            while time.time() - start_time < timeout:
-                msg = await ws.receive_json(timeout=timeout)
-                if "method" in msg and msg["method"] == "signatureNotification":
-                    result = msg["params"]["result"]
-                    if result.get("err"):
-                        logger.error(f"Transaction failed: {result['err']}")
-                        return False
-                    logger.info(
-                        f"Transaction confirmed with {result.get('confirmations', 1)} confirmations"
-                    )
-                    return True
-                elif "error" in msg:
-                    logger.error(f"WebSocket error: {msg['error']}")
-                    return False
-
-            logger.error(f"Transaction timed out after {timeout} seconds")
-            return False
-
-        except asyncio.TimeoutError:
-            logger.error(f"Transaction monitoring timed out after {timeout} seconds")
-            return False
+            confirmed = await self._wait_for_signature_ws(signature, deadline)
+            if confirmed is None:
+                confirmed = await self._poll_signature_status(signature, deadline)
+            if confirmed is None:
+                logger.error(f"Transaction timed out after {timeout} seconds")
+                return False
+            return confirmed
         except Exception as e:
             logger.exception(f"Error monitoring transaction: {e}")
             return False
-        finally:
-            # Unsubscribe and close connection
+
+    async def _wait_for_signature_ws(
+        self, signature: str, deadline: float
+    ) -> Optional[bool]:
+        """Wait for a signatureNotification; None if the WebSocket is unusable"""
+        subscribe_msg = {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "signatureSubscribe",
+            "params": [signature, {"commitment": "confirmed"}],
+        }
+        # 1 接続 1 署名: 並行して確認待ちしても通知が混ざらない
+        ws_session = await self.ensure_ws_session()
+        try:
+            async with ws_session.ws_connect(self.ws_url) as ws:
+                await ws.send_str(json.dumps(subscribe_msg))
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    try:
+                        msg = await ws.receive_json(timeout=remaining)
+                    except asyncio.TimeoutError:
+                        return None
+                    if msg.get("method") == "signatureNotification":
+                        result = msg["params"]["result"]
+                        err = result.get("value", {}).get("err")
+                        if err:
+                            logger.error(f"Transaction failed: {err}")
+                            return False
+                        logger.info(
+                            f"Transaction confirmed at slot {result.get('context', {}).get('slot')}"
+                        )
+                        return True
+                    elif "error" in msg:
+                        logger.warning(
+                            f"WebSocket error, falling back to polling: {msg['error']}"
+                        )
+                        return None
+        except (aiohttp.ClientError, TypeError, ValueError) as e:
+            # TypeError/ValueError: 接続が切れて receive_json が JSON 以外を受け取った
+            logger.warning(f"WebSocket unavailable, falling back to polling: {e}")
+            return None
+
+    async def _poll_signature_status(
+        self, signature: str, deadline: float
+    ) -> Optional[bool]:
+        """Poll getSignatureStatuses until confirmed; None on timeout"""
+        session = await self.ensure_session()
+        payload = {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "getSignatureStatuses",
+            "params": [[signature]],
+        }
+        while time.monotonic() < deadline:
             try:
-                if self.ws:
-                    unsubscribe_msg = {
-                        "jsonrpc": "2.0",
-                        "id": 1,
-                        "method": "signatureUnsubscribe",
-                        "params": [signature],
-                    }
-                    await ws.send_str(json.dumps(unsubscribe_msg))
-                    await self.close_ws()
-            except Exception as e:
-                logger.error(f"Error closing WebSocket: {e}")
+                async with session.post(self.rpc_url, json=payload) as response:
+                    data = await response.json()
+                status = data["result"]["value"][0]
+            except (aiohttp.ClientError, KeyError, TypeError) as e:
+                logger.warning(f"Failed to get signature status: {e}")
+                status = None
+            if status and status.get("err"):
+                logger.error(f"Transaction failed: {status['err']}")
+                return False
+            if status and status.get("confirmationStatus") in (
+                "confirmed",
+                "finalized",
+            ):
+                logger.info("Transaction confirmed")
+                return True
+            await asyncio.sleep(self.poll_interval_s)
+        return None
 
     async def close(self):
         """Close all connections"""
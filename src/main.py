@@ -33,6 +33,8 @@ def load_risk_config() -> RiskConfig:
         min_weight_threshold=Decimal(
             clean_value(os.getenv("MIN_WEIGHT_THRESHOLD", "0.01"))
         ),
+        price_ttl_s=float(clean_value(os.getenv("PRICE_TTL_S", "5"))),
+        max_concurrent_trades=int(clean_value(os.getenv("MAX_CONCURRENT_TRADES", "4"))),
     )
 
 
@@ -1,3 +1,4 @@
+from dataclasses import dataclass
 from datetime import datetime
 from decimal import Decimal
 from typing import List, Optional
@@ -22,11 +23,10 @@ class Token(Base):
     last_updated: Mapped[datetime] = mapped_column(DateTime(timezone=True))
 
 
-class SwapTrade(BaseModel):
+@dataclass(slots=True, kw_only=True)
+class SwapTrade:
     """Swap Trade"""
 
-    model_config = ConfigDict(arbitrary_types_allowed=True, populate_by_name=True)
-
     type: str = "swap"
     from_symbol: str
     from_mint: str
@@ -37,7 +37,6 @@ class SwapTrade(BaseModel):
     to_amount: Decimal
     to_decimals: int
     usd_value: Decimal
-    matched: bool = False
 
     @property
     def from_amount_lamports(self) -> int:
@@ -62,6 +61,9 @@ class RiskConfig(BaseModel):
                 "weight_tolerance": "0.02",
                 "min_weight_threshold": "0.01",
                 "scaling_factor": "10",
+                "price_batch_size": 30,
+                "price_ttl_s": 5,
+                "max_concurrent_trades": 4,
             }
         },
     )
@@ -81,6 +83,17 @@ class RiskConfig(BaseModel):
         description="Minimum portfolio weight threshold", gt=0, le=1
     )
     scaling_factor: Decimal = Field(description="Scaling factor", gt=0)
+    price_batch_size: int = Field(
+        default=30, description="Number of token mints per price request", gt=0
+    )
+    price_ttl_s: float = Field(
+        default=5,
+        description="Seconds to reuse cached token prices between plans (0 disables)",
+        ge=0,
+    )
+    max_concurrent_trades: int = Field(
+        default=4, description="Maximum number of swaps executed at once", gt=0
+    )
 
 
 class TokenAlias(BaseModel):
@@ -1,17 +1,25 @@
+import asyncio
+import time
 from decimal import Decimal
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
-from jupiter import JupiterClient
+from jupiter import JupiterClient, PriceFetchError
 from logger import logger
 from network.solana import RPC_URL
 
 logger = logger.bind(name="token_price_resolver")
 
+# Price chunks requested at the same time (keeps Jupiter rate limits in check)
+MAX_CONCURRENT_PRICE_REQUESTS = 2
+
 
 class TokenPriceResolver:
     def __init__(self, rpc_url: str = RPC_URL):
         self.rpc_url = rpc_url
         self.jupiter_client = JupiterClient(rpc_url=rpc_url)
+        # mint -> (price, fetched_at) kept across plans for TTL reuse.
+        # price is None when Jupiter answered but has no price for the mint.
+        self._price_cache: Dict[str, Tuple[Optional[Decimal], float]] = {}
 
     async def initialize(self):
         """Initialize price resolver"""
@@ -21,8 +29,80 @@ class TokenPriceResolver:
         """Close all connections"""
         await self.jupiter_client.close()
 
-    async def get_token_prices(self, mints: List[str]) -> Dict[str, Decimal]:
+    async def get_token_prices(
+        self, mints: List[str], raise_on_error: bool = False
+    ) -> Dict[str, Decimal]:
         """Get token price from Jupiter"""
         # Get price from Jupiter
-        prices = await self.jupiter_client.get_token_prices(mints)
+        prices = await self.jupiter_client.get_token_prices(
+            mints, raise_on_error=raise_on_error
+        )
+        return prices
+
+    async def get_token_prices_batched(
+        self, mints: List[str], batch_size: int = 30, ttl_s: float = 0
+    ) -> Dict[str, Decimal]:
+        """Get token prices in chunks of ``batch_size`` mints
+
+        Callers should pass a sorted list so that repeated plans request
+        identical URLs. At most ``MAX_CONCURRENT_PRICE_REQUESTS`` requests are
+        in flight at once. If a chunk request fails, its mints are retried one
+        per request so a single bad mint does not drop the whole chunk.
+        Prices, and mints Jupiter has no price for, fetched less than ``ttl_s``
+        seconds ago are served from the cache; ``ttl_s=0`` always fetches.
+        """
+        prices: Dict[str, Decimal] = {}
+        if ttl_s > 0:
+            now = time.monotonic()
+            missing: List[str] = []
+            for mint in mints:
+                cached = self._price_cache.get(mint)
+                if cached is not None and now - cached[1] < ttl_s:
+                    if cached[0] is not None:
+                        prices[mint] = cached[0]
+                else:
+                    missing.append(mint)
+            mints = missing
+
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_PRICE_REQUESTS)
+
+        async def request(chunk: List[str]) -> Dict[str, Decimal]:
+            async with semaphore:
+                return await self.get_token_prices(chunk, raise_on_error=True)
+
+        async def fetch(chunk: List[str]) -> Dict[str, Optional[Decimal]]:
+            """Prices for the mints that got an answer (None: no price)"""
+            try:
+                result = await request(chunk)
+                return {mint: result.get(mint) for mint in chunk}
+            except PriceFetchError as e:
+                if len(chunk) == 1:
+                    logger.error(f"Failed to fetch price for {chunk[0]}: {e}")
+                    return {}
+                logger.warning(
+                    f"Failed to fetch prices for {len(chunk)} tokens, retrying one by one: {e}"
+                )
+            retries = await asyncio.gather(
+                *(request([mint]) for mint in chunk), return_exceptions=True
+            )
+            answered: Dict[str, Optional[Decimal]] = {}
+            for mint, retry in zip(chunk, retries):
+                if isinstance(retry, PriceFetchError):
+                    logger.error(f"Failed to fetch price for {mint}: {retry}")
+                elif isinstance(retry, BaseException):
+                    raise retry
+                else:
+                    answered[mint] = retry.get(mint)
+            return answered
+
+        chunks = [mints[i : i + batch_size] for i in range(0, len(mints), batch_size)]
+        results = await asyncio.gather(*(fetch(chunk) for chunk in chunks))
+
+        fetched_at = time.monotonic()
+        for result in results:
+            for mint, price in result.items():
+                # 価格のないミントも記録し、TTL 内は再問い合わせしない
+                self._price_cache[mint] = (price, fetched_at)
+                if price is not None:
+                    prices[mint] = price
         return prices
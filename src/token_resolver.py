@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import time
 from dataclasses import dataclass
 from decimal import Decimal
 from typing import Dict, List, Optional
@@ -15,6 +16,10 @@ from network.solana import TOKEN_PROGRAM_ID, RPC_URL
 
 logger = logger.bind(name="token_resolver")
 
+# 未登録トークンを DB に再問い合わせするまでの秒数
+# (update_token_list は別プロセスで DB を更新するため、追加分が見えるよう短めにする)
+METADATA_MISS_TTL_S = 300
+
 
 @dataclass
 class TokenAccount:
@@ -30,7 +35,10 @@ class TokenResolver:
         self.client = None
         self.token_db = {}
         self.engine = create_engine("sqlite:///data/solana.db")
-        self._cache: Dict[str, Token] = {}
+        # address -> {"symbol", "name", "decimals"}; metadata is effectively static
+        self._cache: Dict[str, Dict] = {}
+        # address -> monotonic time of the last DB miss
+        self._missing: Dict[str, float] = {}
         self.logger = logging.getLogger(__name__)
         self.token_replacement_map: Dict[str, str] = {}
 
@@ -41,13 +49,12 @@ class TokenResolver:
     def get_token_info(self, address: str) -> Optional[Dict]:
         """Get token information from cache or database"""
         # Check cache first
-        if address in self._cache:
-            token = self._cache[address]
-            return {
-                "symbol": token.symbol,
-                "name": token.name,
-                "decimals": token.decimals,
-            }
+        info = self._cache.get(address)
+        if info is not None:
+            return dict(info)
+        missed_at = self._missing.get(address)
+        if missed_at is not None and time.monotonic() - missed_at < METADATA_MISS_TTL_S:
+            return None
 
         # Query database
         with Session(self.engine) as session:
@@ -55,13 +62,16 @@ class TokenResolver:
             token = session.scalar(stmt)
             if token:
                 # Cache the result
-                self._cache[address] = token
-                return {
+                info = {
                     "symbol": token.symbol,
                     "name": token.name,
                     "decimals": token.decimals,
                 }
+                self._cache[address] = info
+                self._missing.pop(address, None)
+                return dict(info)
 
+        self._missing[address] = time.monotonic()
         return None
 
     def update_token_info(self, address: str, info: Dict) -> None:
@@ -86,11 +96,18 @@ class TokenResolver:
                 )
                 session.add(token)
 
+            info = {
+                "symbol": token.symbol,
+                "name": token.name,
+                "decimals": token.decimals,
+            }
+
             # Commit changes
             session.commit()
 
             # Update cache
-            self._cache[address] = token
+            self._cache[address] = info
+            self._missing.pop(address, None)
 
     def get_token_symbol(self, address: str) -> str:
         """Get token symbol or fallback to address"""
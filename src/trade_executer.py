@@ -1,6 +1,6 @@
 import asyncio
 from decimal import Decimal
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, cast
 
 from solana.rpc.async_api import AsyncClient
 
@@ -13,6 +13,24 @@ from network.solana import RPC_URL, USDC_MINT
 logger = logger.bind(name="trade_executer")
 
 
+def _trade_stages(trades: List[SwapTrade]) -> List[List[int]]:
+    """Group trade indices into stages that can run concurrently
+
+    A trade is placed one stage after the latest earlier trade whose output is
+    its input, so funds are always produced before they are spent.
+    """
+    stages: List[List[int]] = []
+    # mint -> 最後にその mint を生成するステージ
+    produced_at: Dict[str, int] = {}
+    for i, trade in enumerate(trades):
+        stage = produced_at.get(trade.from_mint, -1) + 1
+        if stage == len(stages):
+            stages.append([])
+        stages[stage].append(i)
+        produced_at[trade.to_mint] = max(produced_at.get(trade.to_mint, -1), stage)
+    return stages
+
+
 class TradeExecuter:
     def __init__(
         self,
@@ -136,45 +154,59 @@ class TradeExecuter:
             raise  # Re-raise to let caller handle the error
 
     async def execute_trades(self, trades: List[SwapTrade]) -> List[SwapResult]:
-        results = []
-        for trade in trades:
-            try:
-                result = await self.execute_swap_with_retry(trade)
-                if result.success:
+        """Execute trades, running independent trades concurrently
+
+        Results are returned in the order of ``trades``. A trade that spends a
+        token produced by an earlier trade in the batch (e.g. a USDC buy funded
+        by a sell into USDC) waits for that trade to finish. At most
+        ``max_concurrent_trades`` swaps are in flight at once.
+        """
+        results: List[Optional[SwapResult]] = [None] * len(trades)
+        semaphore = asyncio.Semaphore(self.risk_config.max_concurrent_trades)
+
+        async def run(index: int) -> None:
+            async with semaphore:
+                results[index] = await self._execute_trade(trades[index])
+
+        for stage in _trade_stages(trades):
+            await asyncio.gather(*(run(i) for i in stage))
+        return cast(List[SwapResult], results)
+
+    async def _execute_trade(self, trade: SwapTrade) -> SwapResult:
+        try:
+            result = await self.execute_swap_with_retry(trade)
+            if result.success:
+                logger.info(
+                    f"Swapped {trade.from_symbol} for {trade.to_symbol} (${trade.usd_value}): {result.tx_signature}"
+                )
+                # トランザクションの確認を待つ
+                if result.tx_signature:
                     logger.info(
-                        f"Swapped {trade.from_symbol} for {trade.to_symbol} (${trade.usd_value}): {result.tx_signature}"
+                        f"Waiting for transaction confirmation: {result.tx_signature}"
                     )
-                    # トランザクションの確認を待つ
-                    if result.tx_signature:
-                        logger.info(
-                            f"Waiting for transaction confirmation: {result.tx_signature}"
-                        )
-                        confirmed = await self.jupiter_client.wait_for_transaction(
-                            result.tx_signature
-                        )
-                        if confirmed:
-                            logger.info(f"Transaction confirmed: {result.tx_signature}")
-                        else:
-                            logger.error(
-                                f"Transaction failed or timed out: {result.tx_signature}"
-                            )
-                else:
-                    raise RuntimeError(
-                        f"Failed to execute trade {trade.from_symbol} -> {trade.to_symbol}: {result.error_message}"
-                    )
-                results.append(result)
-            except Exception as e:
-                logger.exception(
-                    f"Failed to execute trade {trade.from_symbol} -> {trade.to_symbol}: {str(e)}"
-                )
-                results.append(
-                    SwapResult(
-                        success=False,
-                        tx_signature=None,
-                        error_message=str(e),
+                    confirmed = await self.jupiter_client.wait_for_transaction(
+                        result.tx_signature
                     )
+                    if confirmed:
+                        logger.info(f"Transaction confirmed: {result.tx_signature}")
+                    else:
+                        logger.error(
+                            f"Transaction failed or timed out: {result.tx_signature}"
+                        )
+            else:
+                raise RuntimeError(
+                    f"Failed to execute trade {trade.from_symbol} -> {trade.to_symbol}: {result.error_message}"
                 )
-        return results
+            return result
+        except Exception as e:
+            logger.exception(
+                f"Failed to execute trade {trade.from_symbol} -> {trade.to_symbol}: {str(e)}"
+            )
+            return SwapResult(
+                success=False,
+                tx_signature=None,
+                error_message=str(e),
+            )
 
 
 async def main():
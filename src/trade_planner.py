@@ -1,16 +1,140 @@
+import asyncio
+import heapq
+import math
+import sys
+from collections import defaultdict
 from decimal import Decimal
-from typing import Dict, List, Optional
+from typing import DefaultDict, Dict, Final, List, Optional, Tuple
 
 from logger import logger
 from models import RiskConfig, SwapTrade, TokenAlias, Trade
 from network.solana import SOL_MINT, USDC_MINT
-from portfolio import Portfolio
+from portfolio import Portfolio, TokenBalance
 from token_price_resolver import TokenPriceResolver
 from token_resolver import TokenResolver
 
 logger = logger.bind(name="trade_planner")
 
 
+# Per-token actions decided by _classify_weight
+_SKIP: Final = 0
+_SELL_ALL: Final = 1
+_WITHIN_TOLERANCE: Final = 2
+_BUY: Final = 3
+_SELL: Final = 4
+
+# Weights are rounded to this many decimal places before threshold checks so
+# float error cannot flip a gap that is exactly at a threshold
+_WEIGHT_DIGITS: Final = 12
+
+
+def _classify_weight(
+    target_weight: float,
+    current_weight: float,
+    min_weight_threshold: float,
+    weight_tolerance: float,
+) -> Tuple[int, float]:
+    """Decide the action for a token and return it with the absolute weight gap"""
+    target_weight = round(target_weight, _WEIGHT_DIGITS)
+    diff = round(target_weight - current_weight, _WEIGHT_DIGITS)
+    weight_diff = math.fabs(diff)
+    if target_weight < min_weight_threshold:
+        return (_SELL_ALL if current_weight > 0 else _SKIP), weight_diff
+    if weight_diff <= weight_tolerance:
+        return _WITHIN_TOLERANCE, weight_diff
+    return (_BUY if diff > 0 else _SELL), weight_diff
+
+
+def _display_symbol(
+    token: str, current: Optional[TokenBalance], target: Optional[TokenBalance]
+) -> str:
+    """Symbol used for trades and logs, falling back to a shortened mint"""
+    if current:
+        return current.symbol
+    return target.symbol if target else token[:8] + "..."
+
+
+def _empty_trade() -> SwapTrade:
+    """Zero-valued trade used as the factory for pair aggregation"""
+    return SwapTrade(
+        type="swap",
+        from_symbol="",
+        from_mint="",
+        from_amount=Decimal(0),
+        from_decimals=0,
+        to_symbol="",
+        to_mint="",
+        to_amount=Decimal(0),
+        to_decimals=0,
+        usd_value=Decimal(0),
+    )
+
+
+def _match_legs(
+    sells: List[SwapTrade],
+    buys: List[SwapTrade],
+    min_trade_size: Decimal,
+    direct_trades: List[SwapTrade],
+    remaining_sells: List[SwapTrade],
+    remaining_buys: List[SwapTrade],
+) -> None:
+    """Match sells into and buys out of one intermediate token as direct trades"""
+    # 最大の売りと最大の買いを優先的にマッチングし、残余はヒープに戻す
+    # (インデックスをタイブレークにしてSwapTrade同士の比較を避ける)
+    sell_heap = [(-sell.usd_value, i, sell) for i, sell in enumerate(sells)]
+    buy_heap = [(-buy.usd_value, j, buy) for j, buy in enumerate(buys)]
+    heapq.heapify(sell_heap)
+    heapq.heapify(buy_heap)
+
+    while sell_heap and buy_heap:
+        _, i, sell = heapq.heappop(sell_heap)
+        _, j, buy = heapq.heappop(buy_heap)
+        match_value = min(sell.usd_value, buy.usd_value)
+        if match_value < min_trade_size:
+            # 小さい側の最大値が最小取引額未満なので、以降もマッチしない
+            remaining_sells.append(sell)
+            remaining_buys.append(buy)
+            break
+
+        sell_ratio = match_value / sell.usd_value
+        buy_ratio = match_value / buy.usd_value
+
+        # ミントは解決済みなのでそのまま使う
+        direct_trades.append(
+            SwapTrade(
+                type="swap",
+                from_symbol=sell.from_symbol,
+                from_mint=sell.from_mint,
+                from_amount=sell.from_amount * sell_ratio,
+                from_decimals=sell.from_decimals,
+                to_symbol=buy.to_symbol,
+                to_mint=buy.to_mint,
+                to_amount=buy.to_amount * buy_ratio,
+                to_decimals=buy.to_decimals,
+                usd_value=match_value,
+            )
+        )
+
+        # 残余分はその場で縮小してヒープに戻し、次のマッチング候補にする
+        # (売り・買いはこの計画内で生成したものなので変更しても安全)
+        if sell.usd_value > match_value:
+            sell_keep = 1 - sell_ratio
+            sell.from_amount *= sell_keep
+            sell.to_amount *= sell_keep
+            sell.usd_value -= match_value
+            heapq.heappush(sell_heap, (-sell.usd_value, i, sell))
+        if buy.usd_value > match_value:
+            buy_keep = 1 - buy_ratio
+            buy.from_amount *= buy_keep
+            buy.to_amount *= buy_keep
+            buy.usd_value -= match_value
+            heapq.heappush(buy_heap, (-buy.usd_value, j, buy))
+
+    # Collect unmatched trades
+    remaining_sells.extend(sell for _, _, sell in sell_heap)
+    remaining_buys.extend(buy for _, _, buy in buy_heap)
+
+
 class TradePlanner:
     def __init__(
         self,
@@ -20,6 +144,8 @@ class TradePlanner:
         token_resolver: Optional[TokenResolver] = None,
     ):
         self.risk_config = risk_config
+        # 共有されたリゾルバのライフサイクルは所有者が管理する
+        self._owns_price_resolver = token_price_resolver is None
         self.token_price_resolver = token_price_resolver or TokenPriceResolver()
         self.token_resolver = token_resolver or TokenResolver()
 
@@ -31,13 +157,30 @@ class TradePlanner:
                 for replaceable_token in alias.aliases:
                     self.token_replacement_map[replaceable_token] = alias.address
 
+        # 解決済みアドレスのキャッシュ (置換マップは初期化後に変化しない)
+        self._resolved_cache: Dict[str, str] = {}
+
     def resolve_address(self, address: str) -> str:
         """Resolve token address using replacement map"""
+        # Hot path: a single dict lookup for mints seen before
+        try:
+            return self._resolved_cache[address]
+        except KeyError:
+            pass
+
         # Base58 encoded Solana addresses are typically 32-44 characters
         # If longer, it's likely a signature data, so return it unchanged
+        # (unique per call, so they are not cached either)
         if len(address) > 44:
             return address
-        return self.token_replacement_map.get(address, address)
+
+        # Intern so pair keys built from resolved mints hash cheaply
+        resolved = address
+        if self.token_replacement_map:
+            resolved = self.token_replacement_map.get(address, address)
+        resolved = sys.intern(resolved)
+        self._resolved_cache[address] = resolved
+        return resolved
 
     async def initialize(self):
         """Initialize trade planner"""
@@ -45,15 +188,25 @@ class TradePlanner:
             await self.token_price_resolver.initialize()
 
     async def close(self):
-        """Close all connections"""
-        if self.token_price_resolver:
+        """Close all connections
+
+        The resolver and its price cache are kept so the planner can be reused;
+        the HTTP session is reopened lazily on the next price request.
+        """
+        if self._owns_price_resolver:
             await self.token_price_resolver.close()
-            self.token_price_resolver = None
 
     async def create_trade_plan(
         self, current_portfolio: Portfolio, target_portfolio: Portfolio
     ) -> List[Trade]:
         """Create trade plan to match target portfolio with risk management and tolerance"""
+        # Read risk thresholds once instead of on every loop iteration.
+        # Weights are ratios, so they are compared as floats; USD amounts
+        # stay Decimal.
+        min_weight_threshold = float(self.risk_config.min_weight_threshold)
+        weight_tolerance = float(self.risk_config.weight_tolerance)
+        min_trade_size = self.risk_config.min_trade_size_usd
+
         sell_trades: List[SwapTrade] = []  # USDCへの売り取引
         buy_trades: List[SwapTrade] = []  # USDCからの買い取引
 
@@ -61,89 +214,102 @@ class TradePlanner:
         current_total = Decimal(str(current_portfolio.total_value_usd))
 
         # すべてのユニークなトークン（元の表記）を収集し、あらかじめ解決済みのアドレスを算出
-        all_tokens = set(current_portfolio.token_balances.keys()).union(
-            target_portfolio.token_balances.keys()
+        all_tokens = (
+            current_portfolio.token_balances.keys()
+            | target_portfolio.token_balances.keys()
         )
         resolved_map: Dict[str, str] = {
             token: self.resolve_address(token) for token in all_tokens
         }
 
-        # 価格取得のため、解決済みアドレスのリストを作成
-        prices = await self.token_price_resolver.get_token_prices(
-            list(resolved_map.values())
+        # 価格取得のため、解決済みアドレスをソートしたリストを作成
+        # (価格を必要としない重み計算と並行して取得する)
+        price_task = asyncio.create_task(
+            self.token_price_resolver.get_token_prices_batched(
+                sorted(set(resolved_map.values())),
+                batch_size=self.risk_config.price_batch_size,
+                ttl_s=self.risk_config.price_ttl_s,
+            )
         )
+        try:
+            # 一度制御を譲り、重み計算の前にリクエストを送信させる
+            await asyncio.sleep(0)
+
+            # USDCとSOLはスケーリングしない。それ以外はスケーリング係数を掛ける
+            scaling_factor = float(self.risk_config.scaling_factor)
+            scale_map: Dict[str, float] = {USDC_MINT: 1.0, SOL_MINT: 1.0}
+
+            # --- 目標ポートフォリオの重み計算 ---
+            # (エイリアスが同じミントに解決される場合があるため加算で集約する)
+            raw_weights: DefaultDict[str, float] = defaultdict(float)
+            for token, balance in target_portfolio.token_balances.items():
+                scale = scale_map.get(token, scaling_factor)
+                raw_weights[resolved_map[token]] += float(balance.weight) * scale
+            total_adjusted_weight = math.fsum(raw_weights.values())
+
+            # 重みを正規化して合計を1にする
+            adjusted_target: Dict[str, float] = (
+                {
+                    token: weight / total_adjusted_weight
+                    for token, weight in raw_weights.items()
+                }
+                if total_adjusted_weight > 0
+                else dict(raw_weights)
+            )
 
-        # --- 目標ポートフォリオの重み計算 ---
-        def get_weight(token: str) -> Decimal:
-            if token == USDC_MINT:
-                scale = Decimal(1)
-            elif token == SOL_MINT:
-                scale = Decimal(1)
-            else:
-                scale = Decimal(self.risk_config.scaling_factor)
-
-            return Decimal(str(target_portfolio.token_balances[token].weight)) * scale
-
-        adjusted_target: Dict[str, Decimal] = {}
-        total_adjusted_weight = Decimal(0)
-
-        # まず全ての重みを集計
-        for token in all_tokens:
-            resolved_token = resolved_map[token]
-            if token in target_portfolio.token_balances:
-                weight = get_weight(token)
-                adjusted_target[resolved_token] = (
-                    adjusted_target.get(resolved_token, Decimal(0)) + weight
-                )
-                total_adjusted_weight += weight
-
-        # 重みを正規化して合計を1にする
-        if total_adjusted_weight > 0:
-            for token in adjusted_target:
-                adjusted_target[token] = adjusted_target[token] / total_adjusted_weight
-            total_adjusted_weight = Decimal(1)
-
-        # --- 現在のポートフォリオの重み計算 ---
-        current_weights: Dict[str, Decimal] = {}
-        for token in all_tokens:
-            resolved_token = resolved_map[token]
-            current = current_portfolio.token_balances.get(token)
-            if current:
-                cw = (
-                    (Decimal(str(current.usd_value)) / current_total)
-                    if current_total > 0
-                    else Decimal(0)
-                )
-                current_weights[resolved_token] = (
-                    current_weights.get(resolved_token, Decimal(0)) + cw
+            # --- 現在のポートフォリオの重み計算 ---
+            # Multiply by the reciprocal instead of dividing for every token
+            inv_current_total = 1.0 / float(current_total) if current_total > 0 else 0.0
+            # 保有トークンのみを一度だけ走査する
+            current_weights: DefaultDict[str, float] = defaultdict(float)
+            for token, balance in current_portfolio.token_balances.items():
+                current_weights[resolved_map[token]] += (
+                    float(balance.usd_value) * inv_current_total
                 )
+        except BaseException:
+            # 重み計算が失敗した場合は価格取得を中断し、タスクを放置しない
+            price_task.cancel()
+            await asyncio.gather(price_task, return_exceptions=True)
+            raise
 
         # --- トークンごとのトレード生成 ---
+        prices = await price_task
         for token in all_tokens:
             resolved_token = resolved_map[token]
             if resolved_token == USDC_MINT:
                 continue
 
-            price = prices.get(resolved_token, Decimal(0))
+            # 目標の重みが閾値未満で保有もしていない場合は何もしない
+            tw = adjusted_target.get(resolved_token, 0.0)
             current = current_portfolio.token_balances.get(token)
-            target = target_portfolio.token_balances.get(token)
-            symbol = (
-                current.symbol
-                if current
-                else target.symbol if target else token[:8] + "..."
+            if round(tw, _WEIGHT_DIGITS) < min_weight_threshold and current is None:
+                continue
+
+            cw = current_weights.get(resolved_token, 0.0)
+            action, weight_diff = _classify_weight(
+                tw, cw, min_weight_threshold, weight_tolerance
             )
+            if action == _SKIP:
+                continue
 
-            cw = current_weights.get(resolved_token, Decimal(0))
-            tw = adjusted_target.get(resolved_token, Decimal(0))
-            weight_diff = abs(tw - cw)
+            target = target_portfolio.token_balances.get(token)
+
+            # 許容誤差内の場合はスキップ
+            # (ログが出力される場合のみシンボルと差分を整形する)
+            if action == _WITHIN_TOLERANCE:
+                logger.opt(lazy=True).debug(
+                    "Skipping {} {}: weight difference {} within tolerance",
+                    lambda: _display_symbol(token, current, target),
+                    lambda: token,
+                    lambda: f"{weight_diff:.3%}",
+                )
+                continue
+
+            symbol = _display_symbol(token, current, target)
 
             # 目標の重みが閾値未満の場合は売却トレードのみ（保有中の場合）
-            if tw < self.risk_config.min_weight_threshold:
-                if (
-                    current
-                    and cw > 0
-                    and current.usd_value > self.risk_config.min_trade_size_usd
-                ):
+            if action == _SELL_ALL:
+                if current and current.usd_value > min_trade_size:
                     sell_trades.append(
                         SwapTrade(
                             type="swap",
@@ -160,18 +326,13 @@ class TradePlanner:
                     )
                 continue
 
-            # 許容誤差内の場合はスキップ
-            if weight_diff <= self.risk_config.weight_tolerance:
-                logger.debug(
-                    f"Skipping {symbol} {token}: weight difference {weight_diff:.3%} within tolerance"
-                )
-                continue
-
             # 売り・買いの判断
-            if tw > cw:
+            price = prices.get(resolved_token, Decimal(0))
+            # weight_diff は丸め済みなので、文字列経由で誤差なく Decimal に戻す
+            trade_value = current_total * Decimal(str(weight_diff))
+            batch_amount = trade_value / price if price > 0 else Decimal(0)
+            if action == _BUY:
                 # 買い注文：USDCからのスワップ
-                trade_value = current_total * (tw - cw)
-                batch_amount = trade_value / price if price > 0 else Decimal(0)
                 if not (current or target):
                     logger.warning(
                         f"Skipping buy trade for {symbol}: No token information available"
@@ -205,8 +366,6 @@ class TradePlanner:
                 )
             else:
                 # 売り注文：USDCへのスワップ
-                trade_value = current_total * (cw - tw)
-                batch_amount = trade_value / price if price > 0 else Decimal(0)
                 if not current:
                     logger.warning(
                         f"Skipping sell trade for {symbol}: No token information available"
@@ -240,86 +399,44 @@ class TradePlanner:
         remaining_sells: List[SwapTrade] = []
         remaining_buys: List[SwapTrade] = []
 
-        # 買いトレードにフラグを追加（マッチ済みかどうか）
-        for bt in buy_trades:
-            bt.matched = False
-
+        # 中継トークン(通常はUSDC)ごとに索引化し、同じ中継トークン同士のみマッチさせる
+        sells_by_mint: DefaultDict[str, List[SwapTrade]] = defaultdict(list)
         for sell in sell_trades:
-            matched = False
-            for buy in buy_trades:
-                if not buy.matched:
-                    # エイリアス解決を再度実施（既に解決済みであるはず）
-                    if self.resolve_address(sell.to_mint) == self.resolve_address(
-                        buy.from_mint
-                    ):
-                        match_value = min(sell.usd_value, buy.usd_value)
-                        if match_value >= self.risk_config.min_trade_size_usd:
-                            sell_ratio = match_value / sell.usd_value
-                            buy_ratio = match_value / buy.usd_value
-
-                            direct_trades.append(
-                                SwapTrade(
-                                    type="swap",
-                                    from_symbol=sell.from_symbol,
-                                    from_mint=self.resolve_address(sell.from_mint),
-                                    from_amount=sell.from_amount * sell_ratio,
-                                    from_decimals=sell.from_decimals,
-                                    to_symbol=buy.to_symbol,
-                                    to_mint=self.resolve_address(buy.to_mint),
-                                    to_amount=buy.to_amount * buy_ratio,
-                                    to_decimals=buy.to_decimals,
-                                    usd_value=match_value,
-                                )
-                            )
-
-                            # 残余分を個別トレードとして記録
-                            if sell.usd_value > match_value:
-                                remaining_sells.append(
-                                    SwapTrade(
-                                        type="swap",
-                                        from_symbol=sell.from_symbol,
-                                        from_mint=self.resolve_address(sell.from_mint),
-                                        from_amount=sell.from_amount * (1 - sell_ratio),
-                                        from_decimals=sell.from_decimals,
-                                        to_symbol=sell.to_symbol,
-                                        to_mint=self.resolve_address(sell.to_mint),
-                                        to_amount=sell.to_amount * (1 - sell_ratio),
-                                        to_decimals=6,
-                                        usd_value=sell.usd_value - match_value,
-                                    )
-                                )
-                            if buy.usd_value > match_value:
-                                remaining_buys.append(
-                                    SwapTrade(
-                                        type="swap",
-                                        from_symbol=buy.from_symbol,
-                                        from_mint=self.resolve_address(buy.from_mint),
-                                        from_amount=buy.from_amount * (1 - buy_ratio),
-                                        from_decimals=6,
-                                        to_symbol=buy.to_symbol,
-                                        to_mint=self.resolve_address(buy.to_mint),
-                                        to_amount=buy.to_amount * (1 - buy_ratio),
-                                        to_decimals=buy.to_decimals,
-                                        usd_value=buy.usd_value - match_value,
-                                    )
-                                )
-                            buy.matched = True
-                            matched = True
-                            break
-            if not matched:
-                remaining_sells.append(sell)
-
-        # Collect unmatched buy trades
-        remaining_buys.extend([buy for buy in buy_trades if not buy.matched])
+            sells_by_mint[sell.to_mint].append(sell)
+        buys_by_mint: DefaultDict[str, List[SwapTrade]] = defaultdict(list)
+        for buy in buy_trades:
+            buys_by_mint[buy.from_mint].append(buy)
+
+        for mint, sells in sells_by_mint.items():
+            _match_legs(
+                sells,
+                buys_by_mint.pop(mint, []),
+                min_trade_size,
+                direct_trades,
+                remaining_sells,
+                remaining_buys,
+            )
+        for buys in buys_by_mint.values():
+            remaining_buys.extend(buys)
 
         # --- Combine and optimize all trades ---
-        all_trades = direct_trades + remaining_sells + remaining_buys
+        return self._optimize_trades(direct_trades + remaining_sells + remaining_buys)
+
+    def _optimize_trades(self, trades: List[SwapTrade]) -> List[Trade]:
+        """Aggregate trades by pair, pair up USDC legs and split by max trade size"""
+        min_trade_size = self.risk_config.min_trade_size_usd
+        max_trade_size = self.risk_config.max_trade_size_usd
 
         # Aggregate trades by token pair
-        pair_trades: Dict[str, SwapTrade] = {}
+        pair_trades: DefaultDict[Tuple[str, str], SwapTrade] = defaultdict(
+            _empty_trade
+        )
+        # Aggregated trades routed through USDC
+        sells_to_usdc: List[SwapTrade] = []
+        buys_from_usdc: List[SwapTrade] = []
 
         # First pass to aggregate trades
-        for trade in all_trades:
+        for trade in trades:
             # Validate addresses before processing
             from_mint = self.resolve_address(trade.from_mint)
             to_mint = self.resolve_address(trade.to_mint)
@@ -331,145 +448,117 @@ class TradePlanner:
                 )
                 continue
 
-            pair_key = f"{from_mint}->{to_mint}"
-            if pair_key not in pair_trades:
-                pair_trades[pair_key] = SwapTrade(
-                    type="swap",
-                    from_symbol=trade.from_symbol,
-                    from_mint=from_mint,
-                    from_amount=Decimal(0),
-                    from_decimals=trade.from_decimals,
-                    to_symbol=trade.to_symbol,
-                    to_mint=to_mint,
-                    to_amount=Decimal(0),
-                    to_decimals=trade.to_decimals,
-                    usd_value=Decimal(0),
-                )
-
-            pair_trades[pair_key].from_amount += trade.from_amount
-            pair_trades[pair_key].to_amount += trade.to_amount
-            pair_trades[pair_key].usd_value += trade.usd_value
-
-            # Record trades using intermediate tokens
-            if to_mint == USDC_MINT:
-                if from_mint not in pair_trades:
-                    pair_trades[from_mint] = SwapTrade(
-                        type="swap",
-                        from_symbol=trade.from_symbol,
-                        from_mint=from_mint,
-                        from_amount=Decimal(0),
-                        from_decimals=trade.from_decimals,
-                        to_symbol=trade.to_symbol,
-                        to_mint=to_mint,
-                        to_amount=Decimal(0),
-                        to_decimals=trade.to_decimals,
-                        usd_value=Decimal(0),
-                    )
-                pair_trades[from_mint].from_amount += trade.from_amount
-                pair_trades[from_mint].to_amount += trade.to_amount
-                pair_trades[from_mint].usd_value += trade.usd_value
-
-        # Convert trades using intermediate tokens to direct trades
-        optimized_pairs: Dict[str, SwapTrade] = {}
-
-        # Find trade pairs using the same intermediate token
-        for from_mint, from_trades in pair_trades.items():
-            # Skip invalid addresses
-            if len(from_mint) > 44:
+            pair_trade = pair_trades[(from_mint, to_mint)]
+            if not pair_trade.from_mint:
+                # First trade for this pair: fill in the identifying fields
+                pair_trade.from_symbol = trade.from_symbol
+                pair_trade.from_mint = from_mint
+                pair_trade.from_decimals = trade.from_decimals
+                pair_trade.to_symbol = trade.to_symbol
+                pair_trade.to_mint = to_mint
+                pair_trade.to_decimals = trade.to_decimals
+
+                # Record trades using intermediate tokens
+                if to_mint == USDC_MINT:
+                    sells_to_usdc.append(pair_trade)
+                elif from_mint == USDC_MINT:
+                    buys_from_usdc.append(pair_trade)
+
+            pair_trade.from_amount += trade.from_amount
+            pair_trade.to_amount += trade.to_amount
+            pair_trade.usd_value += trade.usd_value
+
+        # Convert trades using intermediate tokens to direct trades.
+        # Greedily pair the largest sell into USDC with the largest buy from USDC.
+        # Each step exhausts at least one side, so this is linear after sorting.
+        # Direct trades accumulate into pair_trades so one final pass emits them.
+        sells_to_usdc.sort(key=lambda t: t.usd_value, reverse=True)
+        buys_from_usdc.sort(key=lambda t: t.usd_value, reverse=True)
+        i = j = 0
+        while i < len(sells_to_usdc) and j < len(buys_from_usdc):
+            from_trade = sells_to_usdc[i]
+            to_trade = buys_from_usdc[j]
+            if from_trade.usd_value < min_trade_size:
+                i += 1
                 continue
-
-            for to_mint, to_trades in pair_trades.items():
-                # Skip invalid addresses
-                if len(to_mint) > 44:
-                    continue
-
-                if from_mint != to_mint:
-                    # Find trade pairs using the same intermediate token
-                    for from_trade in from_trades:
-                        for to_trade in to_trades:
-                            if (
-                                from_trade.to_mint == USDC_MINT
-                                and to_trade.from_mint == USDC_MINT
-                            ):
-                                # Create direct trade based on the smaller trade size
-                                match_value = min(
-                                    from_trade.usd_value, to_trade.usd_value
-                                )
-                                if match_value >= self.risk_config.min_trade_size_usd:
-                                    from_ratio = match_value / from_trade.usd_value
-                                    to_ratio = match_value / to_trade.usd_value
-
-                                    direct_key = f"{from_mint}->{to_mint}"
-                                    if direct_key not in optimized_pairs:
-                                        optimized_pairs[direct_key] = SwapTrade(
-                                            type="swap",
-                                            from_symbol=from_trade.from_symbol,
-                                            from_mint=from_mint,
-                                            from_amount=Decimal(0),
-                                            from_decimals=from_trade.from_decimals,
-                                            to_symbol=to_trade.to_symbol,
-                                            to_mint=to_mint,
-                                            to_amount=Decimal(0),
-                                            to_decimals=to_trade.to_decimals,
-                                            usd_value=Decimal(0),
-                                        )
-
-                                    direct_trade = optimized_pairs[direct_key]
-                                    direct_trade.from_amount += (
-                                        from_trade.from_amount * from_ratio
-                                    )
-                                    direct_trade.to_amount += (
-                                        to_trade.to_amount * to_ratio
-                                    )
-                                    direct_trade.usd_value += match_value
-
-                                    # Reduce used portion from original trades
-                                    from_trade.from_amount -= (
-                                        from_trade.from_amount * from_ratio
-                                    )
-                                    from_trade.to_amount -= (
-                                        from_trade.to_amount * from_ratio
-                                    )
-                                    from_trade.usd_value -= match_value
-
-                                    to_trade.from_amount -= (
-                                        to_trade.from_amount * to_ratio
-                                    )
-                                    to_trade.to_amount -= to_trade.to_amount * to_ratio
-                                    to_trade.usd_value -= match_value
-
-        # Add remaining trades
-        for trade in pair_trades.values():
-            if trade.usd_value >= self.risk_config.min_trade_size_usd:
-                # Skip trades with invalid addresses
-                if len(trade.from_mint) > 44 or len(trade.to_mint) > 44:
-                    continue
-
-                pair_key = f"{trade.from_mint}->{trade.to_mint}"
-                if pair_key not in optimized_pairs:
-                    optimized_pairs[pair_key] = trade
+            if to_trade.usd_value < min_trade_size:
+                j += 1
+                continue
+            # A token cannot be swapped into itself. Try the next buy against
+            # this sell and keep buy j for a later sell; if no other buy is
+            # left, only buy j remains and this sell cannot match it.
+            if from_trade.from_mint == to_trade.to_mint:
+                if j + 1 < len(buys_from_usdc):
+                    buys_from_usdc[j], buys_from_usdc[j + 1] = (
+                        buys_from_usdc[j + 1],
+                        buys_from_usdc[j],
+                    )
                 else:
-                    optimized_pairs[pair_key].from_amount += trade.from_amount
-                    optimized_pairs[pair_key].to_amount += trade.to_amount
-                    optimized_pairs[pair_key].usd_value += trade.usd_value
-
-        # Optimize and combine trades
-        optimized_trades: List[Trade] = []
-        for trade in optimized_pairs.values():
-            if trade.usd_value < self.risk_config.min_trade_size_usd:
+                    i += 1
                 continue
 
-            # Final validation of addresses
-            if len(trade.from_mint) > 44 or len(trade.to_mint) > 44:
+            # Create direct trade based on the smaller trade size
+            match_value = min(from_trade.usd_value, to_trade.usd_value)
+            from_ratio = match_value / from_trade.usd_value
+            to_ratio = match_value / to_trade.usd_value
+
+            direct_trade = pair_trades[(from_trade.from_mint, to_trade.to_mint)]
+            if not direct_trade.from_mint:
+                direct_trade.from_symbol = from_trade.from_symbol
+                direct_trade.from_mint = from_trade.from_mint
+                direct_trade.from_decimals = from_trade.from_decimals
+                direct_trade.to_symbol = to_trade.to_symbol
+                direct_trade.to_mint = to_trade.to_mint
+                direct_trade.to_decimals = to_trade.to_decimals
+
+            direct_trade.from_amount += from_trade.from_amount * from_ratio
+            direct_trade.to_amount += to_trade.to_amount * to_ratio
+            direct_trade.usd_value += match_value
+
+            # Reduce used portion from original trades
+            from_keep = 1 - from_ratio
+            from_trade.from_amount *= from_keep
+            from_trade.to_amount *= from_keep
+            from_trade.usd_value -= match_value
+
+            to_keep = 1 - to_ratio
+            to_trade.from_amount *= to_keep
+            to_trade.to_amount *= to_keep
+            to_trade.usd_value -= match_value
+
+        # Split direct trades and remaining USDC legs into batches
+        optimized_trades: List[Trade] = []
+        for trade in pair_trades.values():
+            # Addresses were validated once when the pair was aggregated
+            if trade.usd_value < min_trade_size:
                 continue
 
-            remaining_value = trade.usd_value
-            while remaining_value > 0:
-                batch_value = min(remaining_value, self.risk_config.max_trade_size_usd)
-                if batch_value < self.risk_config.min_trade_size_usd:
-                    break
+            # 最大サイズのバッチ数と端数を一度に計算する
+            n_full, remainder = divmod(trade.usd_value, max_trade_size)
+            inv_usd = Decimal(1) / trade.usd_value
+            full_ratio = max_trade_size * inv_usd
+            full_from_amount = trade.from_amount * full_ratio
+            full_to_amount = trade.to_amount * full_ratio
+            # 実行側での変更に備えてバッチごとに別インスタンスを作る
+            optimized_trades.extend(
+                SwapTrade(
+                    type="swap",
+                    from_symbol=trade.from_symbol,
+                    from_mint=trade.from_mint,
+                    from_amount=full_from_amount,
+                    from_decimals=trade.from_decimals,
+                    to_symbol=trade.to_symbol,
+                    to_mint=trade.to_mint,
+                    to_amount=full_to_amount,
+                    to_decimals=trade.to_decimals,
+                    usd_value=max_trade_size,
+                )
+                for _ in range(int(n_full))
+            )
 
-                ratio = batch_value / trade.usd_value
+            # min_trade_size_usd is validated > 0, so this also excludes zero
+            if remainder >= min_trade_size:
+                ratio = remainder * inv_usd
                 optimized_trades.append(
                     SwapTrade(
                         type="swap",
@@ -481,9 +570,8 @@ class TradePlanner:
                         to_mint=trade.to_mint,
                         to_amount=trade.to_amount * ratio,
                         to_decimals=trade.to_decimals,
-                        usd_value=batch_value,
+                        usd_value=remainder,
                     )
                 )
-                remaining_value -= batch_value
 
         return optimized_trades
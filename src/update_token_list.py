@@ -8,6 +8,7 @@ from typing import Dict, List
 import aiohttp
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 
 from models import Base, Token
@@ -89,41 +90,42 @@ async def fetch_jupiter_tokens(session: aiohttp.ClientSession) -> List[Dict]:
         return []
 
 
-def create_token_data(jupiter_tokens: List[Dict]) -> List[Token]:
-    """Create token data from Jupiter token list"""
-    tokens = []
-    for token in jupiter_tokens:
-        tokens.append(
-            Token(
-                address=token["address"],
-                symbol=token["symbol"],
-                name=token["name"],
-                decimals=token["decimals"],
-                source="jupiter",
-                last_updated=datetime.now(UTC),
-            )
-        )
-    return tokens
-
-
-def save_token_data(tokens: List[Token]):
+def create_token_data(jupiter_tokens: List[Dict]) -> List[Dict]:
+    """Create token rows for the tokens table from Jupiter token list"""
+    # One timestamp for the whole update instead of one per token
+    now = datetime.now(UTC)
+    return [
+        {
+            "address": token["address"],
+            "symbol": token["symbol"],
+            "name": token["name"],
+            "decimals": token["decimals"],
+            "source": "jupiter",
+            "last_updated": now,
+        }
+        for token in jupiter_tokens
+    ]
+
+
+def save_token_data(tokens: List[Dict]):
     """Save token data to SQLite database"""
     engine = create_engine(DATABASE_URL)
     Base.metadata.create_all(engine)
 
     with Session(engine) as session:
-        # Get existing token addresses
-        existing_addresses = {addr[0] for addr in session.query(Token.address).all()}
-
-        # Filter out tokens that already exist
-        new_tokens = [
-            token for token in tokens if token.address not in existing_addresses
-        ]
-
-        if new_tokens:
-            session.add_all(new_tokens)
+        # Let SQLite skip addresses that already exist instead of loading
+        # every existing address into Python first
+        added = 0
+        if tokens:
+            result = session.connection().execute(
+                sqlite_insert(Token).on_conflict_do_nothing(index_elements=["address"]),
+                tokens,
+            )
             session.commit()
-            log_info(f"Added {len(new_tokens)} new tokens to database")
+            added = result.rowcount
+
+        if added:
+            log_info(f"Added {added} new tokens to database")
         else:
             log_info("No new tokens to add")
 
@@ -138,15 +140,20 @@ async def main():
     # Create data directory if it doesn't exist
     os.makedirs("data", exist_ok=True)
 
-    async with aiohttp.ClientSession() as session:
+    # Pool connections and cache DNS so retries and additional token list
+    # URLs reuse the same TLS connection
+    connector = aiohttp.TCPConnector(limit=32, ttl_dns_cache=300, keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
         # Fetch token data from Jupiter
         jupiter_tokens = await fetch_jupiter_tokens(session)
 
-        # Create token data
-        tokens = create_token_data(jupiter_tokens)
+    # Create token data
+    tokens = create_token_data(jupiter_tokens)
 
-        # Save token data
-        save_token_data(tokens)
+    # Save token data in a worker thread so the blocking database writes
+    # do not stall the event loop
+    await asyncio.to_thread(save_token_data, tokens)
 
 
 if __name__ == "__main__":
@@ -1,18 +1,56 @@
-import time
+import asyncio
+from datetime import datetime
 from decimal import Decimal
 from unittest.mock import AsyncMock, MagicMock, patch
 
+import aiohttp
 import pytest
 import pytest_asyncio
-from aiohttp import ClientSession
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
 
 from src.copy_agent import CopyTradeAgent, Portfolio, RiskConfig, TokenBalance
 from src.dex.base import SwapQuote
-from src.models import SwapResult, SwapTrade
+from src.jupiter import JupiterClient, PriceFetchError
+from src.models import Base, SwapResult, SwapTrade, Token
+from src.network.solana import USDC_MINT
+from src.token_price_resolver import TokenPriceResolver
+from src.token_resolver import METADATA_MISS_TTL_S, TokenResolver
+from src.trade_executer import TradeExecuter
 
+# Decimal values shared by the trade plan portfolios (Decimal is immutable)
+_PORTFOLIO_TOTAL_USD = Decimal("1000.0")
+_UNIT_PRICE = Decimal("1.0")
 
-@pytest.fixture
+# Fixed portfolio timestamp so fixtures are deterministic
+_T0 = 1_700_000_000.0
+
+
+def _build_mock_keypair() -> MagicMock:
+    mock_pubkey = MagicMock()
+    mock_pubkey.__str__.return_value = (
+        "11111111111111111111111111111111"  # Valid Base58 string
+    )
+    mock_keypair = MagicMock()
+    mock_keypair.pubkey.return_value = mock_pubkey
+    return mock_keypair
+
+
+@pytest.fixture(autouse=True, scope="module")
+def _patch_keypair():
+    # Start the Keypair/base58 patchers once per module instead of per test
+    # (b58decode returns a 32-byte secret key)
+    with (
+        patch("src.copy_agent.Keypair") as mock_keypair_class,
+        patch("src.copy_agent.base58.b58decode", return_value=b"0" * 32),
+    ):
+        mock_keypair_class.from_seed.return_value = _build_mock_keypair()
+        yield mock_keypair_class
+
+
+@pytest.fixture(scope="module")
 def risk_config():
+    # RiskConfig is never mutated by the tests, so one instance is shared
     return RiskConfig(
         max_trade_size_usd=Decimal("1000"),
         min_trade_size_usd=Decimal("10"),
@@ -21,6 +59,7 @@ def risk_config():
         gas_buffer_sol=Decimal("0.1"),
         weight_tolerance=Decimal("0.02"),
         min_weight_threshold=Decimal("0.01"),
+        scaling_factor=Decimal("10"),
     )
 
 
@@ -28,7 +67,8 @@ def risk_config():
 async def agent(risk_config: RiskConfig) -> CopyTradeAgent:
     agent = CopyTradeAgent(rpc_url="http://test-rpc.url", risk_config=risk_config)
     # Mock the session to avoid actual HTTP requests
-    agent.session = AsyncMock(spec=ClientSession)
+    # (no test performs HTTP through it, so an unspecced mock is enough)
+    agent.session = MagicMock()
     # Mock portfolio_analyzer
     agent.portfolio_analyzer = AsyncMock()
     agent.portfolio_analyzer.initialize = AsyncMock(
@@ -40,7 +80,7 @@ async def agent(risk_config: RiskConfig) -> CopyTradeAgent:
     agent.trade_executer = AsyncMock()
     agent.trade_executer.set_wallet_address = MagicMock()
     agent.trade_executer.set_wallet_private_key = MagicMock()
-    agent.trade_executer.dexes = [AsyncMock(), AsyncMock(), AsyncMock(), AsyncMock()]
+    agent.trade_executer.dexes = [MagicMock() for _ in range(4)]
     # Initialize token metadata for testing
     agent.token_metadata = {
         "token1": {
@@ -58,32 +98,36 @@ async def agent(risk_config: RiskConfig) -> CopyTradeAgent:
     await agent.close()
 
 
+# Built once; Portfolio only re-stamps the same total onto them
+_PORTFOLIO_BALANCES = {
+    "token1": TokenBalance(
+        mint="token1",
+        amount=Decimal("10"),
+        decimals=6,
+        usd_value=500.0,
+        symbol="TKN1",
+        _portfolio_total_value=1000.0,
+    ),
+    "token2": TokenBalance(
+        mint="token2",
+        amount=Decimal("20"),
+        decimals=6,
+        usd_value=500.0,
+        symbol="TKN2",
+        _portfolio_total_value=1000.0,
+    ),
+}
+
+
 @pytest.fixture
 def portfolio():
-    token_balances = {
-        "token1": TokenBalance(
-            mint="token1",
-            amount=Decimal("10"),
-            decimals=6,
-            usd_value=500.0,
-            symbol="TKN1",
-            _portfolio_total_value=1000.0,
-        ),
-        "token2": TokenBalance(
-            mint="token2",
-            amount=Decimal("20"),
-            decimals=6,
-            usd_value=500.0,
-            symbol="TKN2",
-            _portfolio_total_value=1000.0,
-        ),
-    }
     return Portfolio(
-        total_value_usd=1000.0, token_balances=token_balances, timestamp=time.time()
+        total_value_usd=1000.0,
+        token_balances=dict(_PORTFOLIO_BALANCES),
+        timestamp=_T0,
     )
 
 
-@pytest.mark.asyncio
 async def test_initialize_error(agent):
     """Test that initialization fails when JupiterClient doesn't have initialize method"""
     with pytest.raises(
@@ -92,7 +136,6 @@ async def test_initialize_error(agent):
         await agent.initialize()
 
 
-@pytest.mark.asyncio
 async def test_create_target_portfolio_error():
     """Test that create_target_portfolio fails when TokenBalance is missing decimals"""
     with pytest.raises(
@@ -106,7 +149,6 @@ async def test_create_target_portfolio_error():
         )
 
 
-@pytest.mark.asyncio
 async def test_get_best_quote(agent):
     # Mock DEX responses
     mock_quote2 = SwapQuote(
@@ -130,14 +172,118 @@ async def test_get_best_quote(agent):
     assert quote.expected_output_amount == Decimal("95")
 
 
-@pytest.mark.asyncio
+async def test_get_token_prices_batched_reuses_cached_prices():
+    resolver = TokenPriceResolver(rpc_url="http://test-rpc.url")
+    resolver.get_token_prices = AsyncMock(
+        return_value={"token1": _UNIT_PRICE, "token2": _UNIT_PRICE}
+    )
+
+    first = await resolver.get_token_prices_batched(["token1", "token2"], ttl_s=300)
+    second = await resolver.get_token_prices_batched(["token1", "token2"], ttl_s=300)
+    assert first == second
+    resolver.get_token_prices.assert_awaited_once()
+
+    # ttl_s=0 always goes to the network
+    await resolver.get_token_prices_batched(["token1", "token2"])
+    assert resolver.get_token_prices.await_count == 2
+
+
+async def test_get_token_prices_batched_retries_failed_chunk_per_mint():
+    resolver = TokenPriceResolver(rpc_url="http://test-rpc.url")
+
+    async def get_token_prices(mints, raise_on_error=False):
+        if len(mints) > 1 or mints == ["token3"]:
+            raise PriceFetchError("Rate limited by Jupiter API")
+        return {"token1": _UNIT_PRICE} if mints == ["token1"] else {}
+
+    resolver.get_token_prices = AsyncMock(side_effect=get_token_prices)
+
+    prices = await resolver.get_token_prices_batched(
+        ["token1", "token2", "token3"], ttl_s=300
+    )
+    assert prices == {"token1": _UNIT_PRICE}
+    assert resolver.get_token_prices.await_count == 4
+
+    # token2 has no price and is cached as such; only the failed token3 is retried
+    resolver.get_token_prices.reset_mock()
+    await resolver.get_token_prices_batched(["token1", "token2", "token3"], ttl_s=300)
+    resolver.get_token_prices.assert_awaited_once_with(["token3"], raise_on_error=True)
+
+
+async def test_get_token_prices_batched_does_not_retry_unpriced_mints():
+    resolver = TokenPriceResolver(rpc_url="http://test-rpc.url")
+    # Jupiter answered but has no price for token2 (e.g. a spam token)
+    resolver.get_token_prices = AsyncMock(return_value={"token1": _UNIT_PRICE})
+
+    prices = await resolver.get_token_prices_batched(["token1", "token2"], ttl_s=300)
+    assert prices == {"token1": _UNIT_PRICE}
+    await resolver.get_token_prices_batched(["token1", "token2"], ttl_s=300)
+    resolver.get_token_prices.assert_awaited_once()
+
+
+@pytest.fixture
+def token_resolver():
+    resolver = TokenResolver(rpc_url="http://test-rpc.url")
+    resolver.engine = create_engine("sqlite://")
+    Base.metadata.create_all(resolver.engine)
+    return resolver
+
+
+def _add_token(resolver, address):
+    # Written directly, as update_token_list does from its own process
+    with Session(resolver.engine) as session:
+        session.add(
+            Token(
+                address=address,
+                symbol="TKN1",
+                name="Token 1",
+                decimals=6,
+                source="test",
+                last_updated=datetime(2024, 1, 1),
+            )
+        )
+        session.commit()
+
+
+def test_get_token_info_caches_miss_within_ttl(token_resolver):
+    with patch("src.token_resolver.time.monotonic", return_value=_T0):
+        assert token_resolver.get_token_info("token1") is None
+    _add_token(token_resolver, "token1")
+
+    # Within the TTL the miss is served from memory without querying the DB
+    now = _T0 + METADATA_MISS_TTL_S - 1
+    with patch("src.token_resolver.time.monotonic", return_value=now):
+        assert token_resolver.get_token_info("token1") is None
+
+
+def test_get_token_info_requeries_miss_after_ttl(token_resolver):
+    with patch("src.token_resolver.time.monotonic", return_value=_T0):
+        assert token_resolver.get_token_info("token1") is None
+    _add_token(token_resolver, "token1")
+
+    now = _T0 + METADATA_MISS_TTL_S
+    with patch("src.token_resolver.time.monotonic", return_value=now):
+        info = token_resolver.get_token_info("token1")
+    assert info == {"symbol": "TKN1", "name": "Token 1", "decimals": 6}
+    assert "token1" not in token_resolver._missing
+
+
+def test_update_token_info_clears_miss(token_resolver):
+    assert token_resolver.get_token_info("token1") is None
+    _add_token(token_resolver, "token1")
+
+    token_resolver.update_token_info("token1", {"symbol": "NEW"})
+    assert "token1" not in token_resolver._missing
+    assert token_resolver.get_token_info("token1")["symbol"] == "NEW"
+
+
 async def test_create_trade_plan(agent):
     # Mock token_price_resolver
     agent.trade_planner.token_price_resolver = AsyncMock()
-    agent.trade_planner.token_price_resolver.get_token_prices = AsyncMock(
+    agent.trade_planner.token_price_resolver.get_token_prices_batched = AsyncMock(
         return_value={
-            "token1": Decimal("1.0"),
-            "token2": Decimal("1.0"),
+            "token1": _UNIT_PRICE,
+            "token2": _UNIT_PRICE,
         }
     )
 
@@ -149,7 +295,7 @@ async def test_create_trade_plan(agent):
             decimals=6,
             usd_value=Decimal("500.0"),
             symbol="TKN1",
-            _portfolio_total_value=Decimal("1000.0"),
+            _portfolio_total_value=_PORTFOLIO_TOTAL_USD,
         ),
         "token2": TokenBalance(
             mint="token2",
@@ -157,13 +303,13 @@ async def test_create_trade_plan(agent):
             decimals=6,
             usd_value=Decimal("500.0"),
             symbol="TKN2",
-            _portfolio_total_value=Decimal("1000.0"),
+            _portfolio_total_value=_PORTFOLIO_TOTAL_USD,
         ),
     }
     current_portfolio = Portfolio(
-        total_value_usd=Decimal("1000.0"),
+        total_value_usd=_PORTFOLIO_TOTAL_USD,
         token_balances=current_balances,
-        timestamp=time.time(),
+        timestamp=_T0,
     )
 
     # Create target portfolio
@@ -174,7 +320,7 @@ async def test_create_trade_plan(agent):
             decimals=6,
             usd_value=Decimal("250.0"),
             symbol="TKN1",
-            _portfolio_total_value=Decimal("1000.0"),
+            _portfolio_total_value=_PORTFOLIO_TOTAL_USD,
         ),
         "token2": TokenBalance(
             mint="token2",
@@ -182,13 +328,13 @@ async def test_create_trade_plan(agent):
             decimals=6,
             usd_value=Decimal("750.0"),
             symbol="TKN2",
-            _portfolio_total_value=Decimal("1000.0"),
+            _portfolio_total_value=_PORTFOLIO_TOTAL_USD,
         ),
     }
     target_portfolio = Portfolio(
-        total_value_usd=Decimal("1000.0"),
+        total_value_usd=_PORTFOLIO_TOTAL_USD,
         token_balances=target_balances,
-        timestamp=time.time(),
+        timestamp=_T0,
     )
 
     trades = await agent.create_trade_plan(current_portfolio, target_portfolio)
@@ -202,84 +348,212 @@ async def test_create_trade_plan(agent):
     assert trade.usd_value == Decimal("250.0")
 
 
-@pytest.mark.asyncio
+async def test_create_trade_plan_cancels_price_fetch_on_error(agent):
+    price_fetch_cancelled = asyncio.Event()
+
+    async def get_token_prices_batched(*args, **kwargs):
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            price_fetch_cancelled.set()
+            raise
+
+    agent.trade_planner.token_price_resolver = AsyncMock()
+    agent.trade_planner.token_price_resolver.get_token_prices_batched = (
+        get_token_prices_batched
+    )
+    current = _unit_price_portfolio({"token1": "1000"})
+    # A balance without a USD value makes the target weight calculation fail
+    target = Portfolio(
+        total_value_usd=_PORTFOLIO_TOTAL_USD,
+        token_balances={
+            "token1": TokenBalance(
+                mint="token1", amount=Decimal("1"), decimals=6, usd_value=None
+            )
+        },
+        timestamp=_T0,
+    )
+
+    with pytest.raises(TypeError):
+        await agent.create_trade_plan(current, target)
+    assert price_fetch_cancelled.is_set()
+
+
+async def test_optimize_trades_pairs_around_shared_mint(agent):
+    def _leg(from_mint, to_mint):
+        return SwapTrade(
+            type="swap",
+            from_symbol=from_mint,
+            from_mint=from_mint,
+            from_amount=Decimal("100"),
+            from_decimals=6,
+            to_symbol=to_mint,
+            to_mint=to_mint,
+            to_amount=Decimal("100"),
+            to_decimals=6,
+            usd_value=Decimal("100"),
+        )
+
+    # token1 is both sold into and bought from USDC (e.g. via an alias)
+    trades = agent.trade_planner._optimize_trades(
+        [
+            _leg("token1", USDC_MINT),
+            _leg("token2", USDC_MINT),
+            _leg(USDC_MINT, "token1"),
+            _leg(USDC_MINT, "token3"),
+        ]
+    )
+
+    # The token1 buy is funded by token2 instead of going through USDC
+    assert sorted((t.from_mint, t.to_mint) for t in trades) == [
+        ("token1", "token3"),
+        ("token2", "token1"),
+    ]
+
+
+def _unit_price_portfolio(usd_values):
+    balances = {
+        mint: TokenBalance(
+            mint=mint,
+            amount=Decimal(usd_value),
+            decimals=6,
+            usd_value=Decimal(usd_value),
+            symbol=mint.upper(),
+        )
+        for mint, usd_value in usd_values.items()
+    }
+    return Portfolio(
+        total_value_usd=_PORTFOLIO_TOTAL_USD, token_balances=balances, timestamp=_T0
+    )
+
+
+@pytest.mark.parametrize(
+    "current, target",
+    [
+        ({"token1": "250", "token2": "750"}, {"token1": "270", "token2": "730"}),
+        ({"token1": "100", "token2": "900"}, {"token1": "120", "token2": "880"}),
+    ],
+)
+async def test_create_trade_plan_skips_gap_exactly_at_tolerance(agent, current, target):
+    agent.trade_planner.token_price_resolver = AsyncMock()
+    agent.trade_planner.token_price_resolver.get_token_prices_batched = AsyncMock(
+        return_value={"token1": _UNIT_PRICE, "token2": _UNIT_PRICE}
+    )
+
+    # Both gaps are exactly weight_tolerance (0.02), so nothing is traded
+    trades = await agent.create_trade_plan(
+        _unit_price_portfolio(current), _unit_price_portfolio(target)
+    )
+    assert trades == []
+
+
 async def test_check_gas_balance(agent):
     # Test with sufficient balance
-    # Mock Keypair
-    mock_pubkey = MagicMock()
-    mock_pubkey.__str__.return_value = (
-        "11111111111111111111111111111111"  # Valid Base58 string
-    )
-    mock_keypair = MagicMock()
-    mock_keypair.pubkey.return_value = mock_pubkey
+    agent.set_wallet_private_key("mock_private_key")  # 実際の値は関係ありません
 
-    with (
-        patch("src.copy_agent.Keypair") as mock_keypair_class,
-        patch("src.copy_agent.base58.b58decode") as mock_b58decode,
-    ):
-        mock_keypair_class.from_seed.return_value = mock_keypair
-        mock_b58decode.return_value = b"0" * 32  # 32バイトの秘密鍵
-        agent.set_wallet_private_key("mock_private_key")  # 実際の値は関係ありません
+    # Mock the client
+    agent.client = AsyncMock()
+    agent.client.get_balance = AsyncMock(
+        return_value=MagicMock(value=200000000)
+    )  # 0.2 SOL
+    assert await agent.check_gas_balance()
+
+    # Test with insufficient balance
+    agent.client.get_balance = AsyncMock(
+        return_value=MagicMock(value=50000000)
+    )  # 0.05 SOL
+    assert not await agent.check_gas_balance()
 
-        # Mock the client
-        agent.client = AsyncMock()
-        agent.client.get_balance = AsyncMock(
-            return_value=MagicMock(value=200000000)
-        )  # 0.2 SOL
-        assert await agent.check_gas_balance()
 
-        # Test with insufficient balance
-        agent.client.get_balance = AsyncMock(
-            return_value=MagicMock(value=50000000)
-        )  # 0.05 SOL
-        assert not await agent.check_gas_balance()
+async def test_set_wallet_private_key_decodes_once(agent):
+    with patch("src.copy_agent.base58.b58decode", return_value=b"0" * 32) as b58decode:
+        agent.set_wallet_private_key("mock_private_key")
+        wallet_address = agent.wallet_address
+        agent.set_wallet_address("other_wallet")
+        agent.set_wallet_private_key("mock_private_key")
+
+    b58decode.assert_called_once_with("mock_private_key")
+    assert agent.wallet_address == wallet_address
 
 
-@pytest.mark.asyncio
 async def test_execute_trades(agent):
-    # Mock Keypair
-    mock_pubkey = MagicMock()
-    mock_pubkey.__str__.return_value = (
-        "11111111111111111111111111111111"  # Valid Base58 string
+    agent.set_wallet_private_key("mock_private_key")  # 実際の値は関係ありません
+
+    trades = [
+        SwapTrade(
+            type="swap",
+            from_symbol="Token1",
+            from_mint="token1",
+            from_amount=Decimal("100"),
+            from_decimals=6,
+            to_symbol="Token2",
+            to_mint="token2",
+            to_amount=Decimal("95"),
+            to_decimals=6,
+            usd_value=Decimal("100"),
+        )
+    ]
+
+    # Mock execute_trade method
+    agent.trade_executer.jupiter_client.execute_swap = AsyncMock(
+        return_value=SwapResult(
+            success=True, tx_signature="test_signature", error_message=None
+        )
     )
-    mock_keypair = MagicMock()
-    mock_keypair.pubkey.return_value = mock_pubkey
 
-    with (
-        patch("src.copy_agent.Keypair") as mock_keypair_class,
-        patch("src.copy_agent.base58.b58decode") as mock_b58decode,
-    ):
-        mock_keypair_class.from_seed.return_value = mock_keypair
-        mock_b58decode.return_value = b"0" * 32  # 32バイトの秘密鍵
-        agent.set_wallet_private_key("mock_private_key")  # 実際の値は関係ありません
-
-        trades = [
-            SwapTrade(
-                type="swap",
-                from_symbol="Token1",
-                from_mint="token1",
-                from_amount=Decimal("100"),
-                from_decimals=6,
-                to_symbol="Token2",
-                to_mint="token2",
-                to_amount=Decimal("95"),
-                to_decimals=6,
-                usd_value=Decimal("100"),
-            )
-        ]
+    # Test executing trades
+    await agent.execute_trades(trades)
+
+
+async def test_execute_trades_runs_independent_trades_concurrently(risk_config):
+    executer = TradeExecuter(rpc_url="http://test-rpc.url", risk_config=risk_config)
+
+    def _trade(from_mint, to_mint):
+        return SwapTrade(
+            type="swap",
+            from_symbol=from_mint,
+            from_mint=from_mint,
+            from_amount=Decimal("100"),
+            from_decimals=6,
+            to_symbol=to_mint,
+            to_mint=to_mint,
+            to_amount=Decimal("100"),
+            to_decimals=6,
+            usd_value=Decimal("100"),
+        )
 
-        # Mock execute_trade method
-        agent.trade_executer.jupiter_client.execute_swap = AsyncMock(
-            return_value=SwapResult(
-                success=True, tx_signature="test_signature", error_message=None
-            )
+    # Two sells into USDC are independent; the buy spends their USDC
+    trades = [
+        _trade("token1", "usdc"),
+        _trade("token2", "usdc"),
+        _trade("usdc", "token3"),
+    ]
+    both_sells_started = asyncio.Event()
+    events = []
+
+    async def execute_swap(trade):
+        events.append(("start", trade.from_mint))
+        if trade.to_mint == "usdc":
+            if len(events) == 2:
+                both_sells_started.set()
+            # Only completes if the other sell is in flight at the same time
+            await asyncio.wait_for(both_sells_started.wait(), timeout=1)
+        events.append(("end", trade.from_mint))
+        return SwapResult(
+            success=True, tx_signature=f"sig_{trade.from_mint}", error_message=None
         )
 
-        # Test executing trades
-        await agent.execute_trades(trades)
+    executer.execute_swap_with_retry = AsyncMock(side_effect=execute_swap)
+    executer.jupiter_client.wait_for_transaction = AsyncMock(return_value=True)
+
+    results = await executer.execute_trades(trades)
+    assert executer.execute_swap_with_retry.call_count == len(trades)
+    assert [r.tx_signature for r in results] == ["sig_token1", "sig_token2", "sig_usdc"]
+    buy_started = events.index(("start", "usdc"))
+    assert buy_started > events.index(("end", "token1"))
+    assert buy_started > events.index(("end", "token2"))
 
 
-@pytest.mark.asyncio
 async def test_wait_for_transaction(agent):
     """Test transaction monitoring with WebSocket"""
     # Mock WebSocket
@@ -319,3 +593,44 @@ async def test_wait_for_transaction(agent):
         "test_signature"
     )
     assert result is False
+
+
+async def test_wait_for_transaction_uses_websocket_push():
+    client = JupiterClient(rpc_url="http://test-rpc.url", poll_interval_s=0)
+    mock_ws = MagicMock()
+    mock_ws.send_str = AsyncMock()
+    mock_ws.receive_json = AsyncMock(
+        side_effect=[
+            {"jsonrpc": "2.0", "result": 42, "id": 1},
+            {
+                "method": "signatureNotification",
+                "params": {
+                    "result": {"context": {"slot": 123456789}, "value": {"err": None}},
+                    "subscription": 42,
+                },
+            },
+        ]
+    )
+    client.ws_session = MagicMock()
+    client.ws_session.ws_connect.return_value.__aenter__.return_value = mock_ws
+    client.session = MagicMock()
+
+    assert await client.wait_for_transaction("test_signature", timeout=1) is True
+    client.session.post.assert_not_called()
+
+
+async def test_wait_for_transaction_falls_back_to_polling():
+    client = JupiterClient(rpc_url="http://test-rpc.url", poll_interval_s=0)
+    client.ws_session = MagicMock()
+    client.ws_session.ws_connect.side_effect = aiohttp.ClientError("refused")
+    client.session = MagicMock()
+    response = client.session.post.return_value.__aenter__.return_value
+    response.json = AsyncMock(
+        side_effect=[
+            {"result": {"value": [None]}},
+            {"result": {"value": [{"confirmationStatus": "confirmed", "err": None}]}},
+        ]
+    )
+
+    assert await client.wait_for_transaction("test_signature", timeout=1) is True
+    assert client.session.post.call_count == 2